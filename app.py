@@ -3,6 +3,12 @@ Gradio интерфейс для маркетингового агента.
 Запуск: python app.py
 """
 
+import re
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
 import gradio as gr
 from marketing_agent import MarketingAgent, TOOLS_SCHEMA
 from typing import Generator, List, Tuple
@@ -11,10 +17,27 @@ from typing import Generator, List, Tuple
 # Создаём агента
 agent = MarketingAgent(max_iterations=8)
 
+# Сколько запусков агента обрабатываются параллельно (агент ждёт LLM API)
+AGENT_CONCURRENCY = 8
+QUEUE_MAX_SIZE = 64
+
+# Ошибки, которые может выбросить агент: сеть (requests.RequestException наследуется
+# от OSError), разбор JSON (JSONDecodeError — это ValueError) и RuntimeError.
+# Ошибки программирования (TypeError, KeyError, AttributeError) не прячем за сообщением в UI.
+# GeneratorExit и asyncio.CancelledError не ловим — отмена должна доходить до Gradio.
+AGENT_ERRORS = (OSError, ValueError, RuntimeError)
+
 
 # ==================== СТИЛИ ====================
 
-CUSTOM_CSS = """
+def _minify_css(css: str) -> str:
+    """Убирает комментарии и лишние пробелы из CSS"""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    return re.sub(r"\s*([:;{},])\s*", r"\1", css).strip()
+
+
+_CUSTOM_CSS_SRC = """
 /* Основные цвета */
 :root {
     --primary: #FF6B35;
@@ -147,30 +170,36 @@ label, .label-wrap {
 }
 """
 
+# Минифицируем один раз при импорте — клиенту уходит компактная строка
+CUSTOM_CSS = _minify_css(_CUSTOM_CSS_SRC)
+
 
 # ==================== ФУНКЦИИ ====================
 
-def format_tools_info() -> str:
-    """Форматирует информацию об инструментах"""
-    tools_md = "### 🛠️ Доступные инструменты\n\n"
-    
-    tool_icons = {
-        "analyze_target_audience": "👥",
-        "estimate_roi": "📊",
-        "analyze_seasonality": "📅",
-        "channel_effectiveness": "📢",
-        "competitor_benchmark": "🏆",
-        "budget_allocator": "💰",
-        "estimate_budget": "💵",
-        "estimate_campaign_duration": "⏱️"
-    }
-    
-    for tool in TOOLS_SCHEMA:
-        icon = tool_icons.get(tool["name"], "🔧")
-        tools_md += f"**{icon} {tool['name']}**\n"
-        tools_md += f"> {tool['description']}\n\n"
-    
-    return tools_md
+# Иконки инструментов для блока с описанием
+TOOL_ICONS = {
+    "analyze_target_audience": "👥",
+    "estimate_roi": "📊",
+    "analyze_seasonality": "📅",
+    "channel_effectiveness": "📢",
+    "competitor_benchmark": "🏆",
+    "budget_allocator": "💰",
+    "estimate_budget": "💵",
+    "estimate_campaign_duration": "⏱️"
+}
+
+# Описание инструментов строится один раз при импорте: TOOLS_SCHEMA статична
+_tools_md_parts = ["### 🛠️ Доступные инструменты\n\n"]
+_tools_md_parts.extend(
+    f"**{TOOL_ICONS.get(tool['name'], '🔧')} {tool['name']}**\n> {tool['description']}\n\n"
+    for tool in TOOLS_SCHEMA
+)
+TOOLS_INFO_MD = "".join(_tools_md_parts)
+
+
+# Шапка и подвал блока с результатом — футер добавляется только в финальном yield
+RESULT_HEADER = "## 📋 Результат анализа\n\n"
+RESULT_FOOTER = "\n\n---\n*Анализ выполнен Marketing Agent за {step_count} шагов*\n"
 
 
 def run_agent(query: str) -> Generator[Tuple[str, str], None, None]:
@@ -179,31 +208,39 @@ def run_agent(query: str) -> Generator[Tuple[str, str], None, None]:
         yield "⚠️ Пожалуйста, введите запрос", ""
         return
     
-    yield "🚀 Запускаю анализ...", ""
+    yield "🚀 Запускаю анализ...", RESULT_HEADER
     
     try:
-        final_result = ""
+        result_buf = ""
+        last_progress = ""
         step_count = 0
+        prev_len = 0
         
+        # run_stream отдаёт несколько обновлений на шаг, а между ними блокируется на вызове LLM,
+        # поэтому пересылаем каждое: придержанный статус пользователь увидел бы только через секунды
         for progress, result in agent.run_stream(query):
-            step_count = len(progress.split("\n")) if progress else 0
+            # Лог только дописывается, поэтому считаем лишь новые переводы строк
+            if progress:
+                if prev_len == 0:
+                    step_count = 1
+                step_count += progress.count("\n", prev_len)
+                prev_len = len(progress)
             
+            last_progress = progress
             if result:
-                # Финальный результат
-                final_result = f"""## 📋 Результат анализа
-
-{result}
-
----
-*Анализ выполнен Marketing Agent за {step_count} шагов*
-"""
-                yield progress, final_result
-            else:
-                # Промежуточный прогресс
-                yield progress, ""
+                result_buf = result
+                # Финальный результат отдаём отдельно, с подвалом
+                continue
+            
+            yield progress, RESULT_HEADER + result_buf
+        
+        if result_buf:
+            # Финальный результат
+            yield last_progress, RESULT_HEADER + result_buf + RESULT_FOOTER.format(step_count=step_count)
         
-    except Exception as e:
-        yield f"❌ Ошибка: {str(e)}", f"Произошла ошибка: {str(e)}"
+    except AGENT_ERRORS as e:
+        error = str(e)
+        yield f"❌ Ошибка: {error}", f"Произошла ошибка: {error}"
 
 
 def clear_all():
@@ -213,12 +250,12 @@ def clear_all():
 
 # ==================== ИНТЕРФЕЙС ====================
 
-EXAMPLES = [
-    ["Мы — стартап в сфере EdTech, запускаем онлайн-курсы по программированию. Бюджет 300,000₽ на 2 месяца. Цель — набрать первых 100 платящих студентов."],
-    ["IT-компания, B2B SaaS для автоматизации HR-процессов. Квартальный бюджет 1,000,000₽. Нужен план по привлечению enterprise-клиентов."],
-    ["Небольшой интернет-магазин одежды, бюджет 150,000₽. Хотим увеличить продажи в предновогодний сезон."],
-    ["Финтех-приложение для инвестиций, таргет — молодёжь 20-30 лет. Бюджет 500,000₽ на awareness кампанию."],
-]
+EXAMPLES = (
+    ("Мы — стартап в сфере EdTech, запускаем онлайн-курсы по программированию. Бюджет 300,000₽ на 2 месяца. Цель — набрать первых 100 платящих студентов.",),
+    ("IT-компания, B2B SaaS для автоматизации HR-процессов. Квартальный бюджет 1,000,000₽. Нужен план по привлечению enterprise-клиентов.",),
+    ("Небольшой интернет-магазин одежды, бюджет 150,000₽. Хотим увеличить продажи в предновогодний сезон.",),
+    ("Финтех-приложение для инвестиций, таргет — молодёжь 20-30 лет. Бюджет 500,000₽ на awareness кампанию.",),
+)
 
 WELCOME_TEXT = """### 👋 Добро пожаловать!
 
@@ -269,10 +306,12 @@ with gr.Blocks(css=CUSTOM_CSS, theme=gr.themes.Base(), title="Marketing Agent")
                 elem_classes=["progress-box"]
             )
             
+            # gr.Examples принимает только list; run_agent для примеров не кэшируем
             gr.Examples(
-                examples=EXAMPLES,
+                examples=[list(example) for example in EXAMPLES],
                 inputs=query_input,
-                label="💡 Примеры запросов"
+                label="💡 Примеры запросов",
+                cache_examples=False
             )
         
         # Правая колонка - результат
@@ -284,7 +323,7 @@ with gr.Blocks(css=CUSTOM_CSS, theme=gr.themes.Base(), title="Marketing Agent")
     
     # Информация об инструментах
     with gr.Accordion("🛠️ Доступные инструменты агента", open=False, elem_classes=["accordion"]):
-        gr.Markdown(format_tools_info())
+        gr.Markdown(TOOLS_INFO_MD)
     
     # Футер
     gr.Markdown("---\n*Powered by DeepSeek V3 🤖 | Built with Gradio 🎨*", elem_classes=["footer"])
@@ -293,13 +332,17 @@ with gr.Blocks(css=CUSTOM_CSS, theme=gr.themes.Base(), title="Marketing Agent")
     submit_btn.click(
         fn=run_agent,
         inputs=[query_input],
-        outputs=[progress_output, result_output]
+        outputs=[progress_output, result_output],
+        concurrency_limit=AGENT_CONCURRENCY,
+        concurrency_id="agent"
     )
     
     query_input.submit(
         fn=run_agent,
         inputs=[query_input],
-        outputs=[progress_output, result_output]
+        outputs=[progress_output, result_output],
+        concurrency_limit=AGENT_CONCURRENCY,
+        concurrency_id="agent"
     )
     
     clear_btn.click(
@@ -311,6 +354,26 @@ with gr.Blocks(css=CUSTOM_CSS, theme=gr.themes.Base(), title="Marketing Agent")
 # ==================== ЗАПУСК ====================
 
 if __name__ == "__main__":
+    # Логи пишутся через очередь: запись в консоль идёт в отдельном потоке
+    log_queue = queue.SimpleQueue()
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    log_listener = QueueListener(log_queue, console_handler, respect_handler_level=True)
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(QueueHandler(log_queue))
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    
+    # uvloop ускоряет event loop сервера, но не обязателен
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    
+    demo.queue(default_concurrency_limit=AGENT_CONCURRENCY, max_size=QUEUE_MAX_SIZE)
     demo.launch(
         server_name="0.0.0.0",
         server_port=7860,
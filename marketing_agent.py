@@ -4,20 +4,53 @@
 """
 
 import os
+import sys
 import json
 import re
+import functools
+import bisect
 import time
-from typing import List, Dict, Any, Optional, Callable
-from dataclasses import dataclass, field
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from typing import List, Dict, Any, Optional, Callable, Mapping
+from dataclasses import dataclass, field, fields
 from enum import Enum
 
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 import urllib3
 
+# RE2 ищет за линейное время без бэктрекинга; если не установлен — стандартный re
+try:
+    import re2 as fast_re
+except ImportError:
+    fast_re = re
+
+# \s в RE2 — только ASCII-пробелы, а в re ещё и NBSP, U+2003 и прочие пробелы Unicode.
+# Без замены "ignore\u00a0previous instructions" под RE2 перестал бы находиться.
+_RE2_UNICODE_SPACE = r"[\s\p{Z}\x0b\x1c-\x1f\x85]"
+
+
+def _compile_fast(pattern: str):
+    """Компилирует паттерн через fast_re с той же семантикой \s, что у стандартного re"""
+    if fast_re is re:
+        return re.compile(pattern)
+    return fast_re.compile(pattern.replace(r"\s", _RE2_UNICODE_SPACE))
+
+# orjson заметно быстрее stdlib json; если не установлен — используем json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 load_dotenv()
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Обработчики логов настраивает точка входа (app.py), модуль их не трогает
+logger = logging.getLogger(__name__)
+
 
 # ==================== ЗАЩИТА ОТ PROMPT INJECTION ====================
 
@@ -43,42 +76,119 @@ INJECTION_PATTERNS = [
     r"exec\s*\(",
 ]
 
-# Компилируем паттерны для быстрого поиска
-INJECTION_REGEX = re.compile("|".join(INJECTION_PATTERNS), re.IGNORECASE)
+# Компилируем паттерны для быстрого поиска (флаг inline: у RE2 нет re.IGNORECASE)
+INJECTION_REGEX = _compile_fast("(?i)" + "|".join(INJECTION_PATTERNS))
 
+# Потенциально опасные теги, которые удаляются из ввода
+DANGEROUS_TAGS = ["<system>", "</system>", "<admin>", "</admin>", "[INST]", "[/INST]"]
 
-def sanitize_input(user_input: str, max_length: int = 5000) -> tuple[str, list[str]]:
+# Все теги удаляются одним subn без Python-колбэка на каждое совпадение.
+# У каждого тега своя группа: сработавший тег определяется по lastindex — через .lower()
+# нельзя, IGNORECASE совпадает и с "ſ"/"İ", которые .lower() в s/i не приводит
+_DANGEROUS_TAGS_REGEX = re.compile("|".join(f"({re.escape(tag)})" for tag in DANGEROUS_TAGS), re.IGNORECASE)
+
+# Управляющие символы (кроме табуляции и переводов строк) обрабатываются одним str.translate:
+# посимвольная замена на C-уровне дешевле re.sub по классу символов.
+# \x0b, \x0c и \x1c-\x1f для \s — пробелы: их заменяем пробелом, иначе удаление склеит слова
+# ("ignore\x0cprevious") и injection-паттерн не сработает. Остальные удаляем.
+_WHITESPACE_CONTROLS = (11, 12, 28, 29, 30, 31)
+_CONTROL_CHARS_TABLE = {
+    c: " " if c in _WHITESPACE_CONTROLS else None
+    for c in [*range(32), 127]
+    if c not in (9, 10, 13)
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def _sanitize_input_cached(user_input: str, truncated_to: Optional[int]) -> tuple[str, tuple[str, ...], tuple]:
     """
-    Санитизация пользовательского ввода.
-    
-    Returns:
-        tuple: (очищенный текст, список предупреждений)
+    Чистая часть санитизации: (очищенный текст, предупреждения, найденные injection паттерны).
+    Принимает уже обрезанный текст, поэтому ключ кэша не длиннее max_length.
     """
     warnings = []
     
-    # Проверка длины
-    if len(user_input) > max_length:
-        user_input = user_input[:max_length]
-        warnings.append(f"Текст обрезан до {max_length} символов")
+    if truncated_to is not None:
+        warnings.append(f"Текст обрезан до {truncated_to} символов")
+    
+    # Управляющие символы убираем до проверок: иначе "<sys\x00tem>" обходит удаление тегов
+    user_input = user_input.translate(_CONTROL_CHARS_TABLE)
     
     # Проверка на injection паттерны
     injection_matches = INJECTION_REGEX.findall(user_input)
     if injection_matches:
         warnings.append(f"Обнаружены подозрительные паттерны: {injection_matches[:3]}")
-        # Не блокируем, но логируем
-        print(f"⚠️ SECURITY: Возможная prompt injection: {injection_matches}")
     
-    # Удаляем потенциально опасные теги
-    dangerous_tags = ["<system>", "</system>", "<admin>", "</admin>", "[INST]", "[/INST]"]
-    for tag in dangerous_tags:
-        if tag.lower() in user_input.lower():
-            user_input = re.sub(re.escape(tag), "", user_input, flags=re.IGNORECASE)
-            warnings.append(f"Удалён тег: {tag}")
+    # Удаляем потенциально опасные теги; без "<" и "[" в тексте их заведомо нет
+    if "<" in user_input or "[" in user_input:
+        cleaned, removed_count = _DANGEROUS_TAGS_REGEX.subn("", user_input)
+        if removed_count:
+            # Редкий случай: повторный проход только чтобы назвать найденные теги
+            found = {DANGEROUS_TAGS[m.lastindex - 1] for m in _DANGEROUS_TAGS_REGEX.finditer(user_input)}
+            warnings.append(f"Удалены теги ({removed_count}): {', '.join(tag for tag in DANGEROUS_TAGS if tag in found)}")
+        user_input = cleaned
     
     # Экранируем специальные последовательности
     user_input = user_input.replace("```", "'''")  # Не даём вставлять code blocks
     
-    return user_input.strip(), warnings
+    return user_input.strip(), tuple(warnings), tuple(injection_matches)
+
+
+def sanitize_input(user_input: str, max_length: int = 5000) -> tuple[str, list[str]]:
+    """
+    Санитизация пользовательского ввода.
+    Результаты кэшируются: повторяющиеся запросы не прогоняются через регулярки заново.
+    
+    Returns:
+        tuple: (очищенный текст, список предупреждений)
+    """
+    # Проверка длины: обрезаем до кэша, чтобы он не хранил произвольно длинные строки
+    truncated_to = None
+    if len(user_input) > max_length:
+        user_input = user_input[:max_length]
+        truncated_to = max_length
+    
+    sanitized, warnings, injection_matches = _sanitize_input_cached(user_input, truncated_to)
+    if injection_matches:
+        # Не блокируем, но логируем (в том числе при попадании в кэш)
+        logger.warning("⚠️ SECURITY: Возможная prompt injection: %s", injection_matches)
+    return sanitized, list(warnings)
+
+
+sanitize_input.cache_info = _sanitize_input_cached.cache_info
+sanitize_input.cache_clear = _sanitize_input_cached.cache_clear
+
+
+# Паттерны в ответе LLM, указывающие на попытку выполнить код
+DANGEROUS_RESPONSE_PATTERNS = [
+    r"os\.(system|popen|exec)",
+    r"subprocess\.",
+    r"eval\s*\(",
+    r"exec\s*\(",
+    r"__import__",
+    r"open\s*\([^)]*,\s*['\"]w",
+]
+
+# Один проход вместо поиска по каждому паттерну; именованная группа указывает на сработавший.
+# Ответы LLM длинные, а [^)]* в паттерне open(...) под re может долго бэктрекать — это тоже RE2.
+_DANGEROUS_PATTERN_BY_GROUP = {f"p{i}": pattern for i, pattern in enumerate(DANGEROUS_RESPONSE_PATTERNS)}
+_DANGEROUS_RESPONSE_REGEX = _compile_fast(
+    "(?i)" + "|".join(f"(?P<{name}>{pattern})" for name, pattern in _DANGEROUS_PATTERN_BY_GROUP.items())
+)
+
+# Каждый опасный паттерн содержит один из этих литералов. Без RE2 поиск подстрок в тексте
+# в нижнем регистре на порядок быстрее регулярки, и чистые ответы до неё не доходят.
+# İ, ı и ſ при IGNORECASE совпадают с i/s, но .lower() их так не приводит — заменяем явно.
+_DANGEROUS_RESPONSE_LITERALS = ("os.", "subprocess.", "eval", "exec", "__import__", "open")
+_CASEFOLD_FIXUPS = str.maketrans({"İ": "i", "ı": "i", "ſ": "s"})
+_USE_LITERAL_PREFILTER = fast_re is re
+
+
+def _may_be_dangerous(response: str) -> bool:
+    """Быстрая проверка: False означает, что ни один опасный паттерн точно не совпадёт"""
+    if "İ" in response or "ı" in response or "ſ" in response:
+        response = response.translate(_CASEFOLD_FIXUPS)
+    text = response.lower()
+    return any(literal in text for literal in _DANGEROUS_RESPONSE_LITERALS)
 
 
 def check_response_safety(response: str) -> tuple[bool, str]:
@@ -88,19 +198,13 @@ def check_response_safety(response: str) -> tuple[bool, str]:
     Returns:
         tuple: (безопасен, причина если нет)
     """
-    # Проверяем, не пытается ли модель выполнить что-то опасное
-    dangerous_patterns = [
-        r"os\.(system|popen|exec)",
-        r"subprocess\.",
-        r"eval\s*\(",
-        r"exec\s*\(",
-        r"__import__",
-        r"open\s*\([^)]*,\s*['\"]w",
-    ]
+    if _USE_LITERAL_PREFILTER and not _may_be_dangerous(response):
+        return True, ""
     
-    for pattern in dangerous_patterns:
-        if re.search(pattern, response, re.IGNORECASE):
-            return False, f"Обнаружен опасный паттерн: {pattern}"
+    # Проверяем, не пытается ли модель выполнить что-то опасное
+    match = _DANGEROUS_RESPONSE_REGEX.search(response)
+    if match:
+        return False, f"Обнаружен опасный паттерн: {_DANGEROUS_PATTERN_BY_GROUP[match.lastgroup]}"
     
     return True, ""
 
@@ -283,527 +387,448 @@ TOOLS_SCHEMA = [
 ]
 
 
+# ==================== РЕЗУЛЬТАТЫ ИНСТРУМЕНТОВ ====================
+
+def _to_plain(value: Any) -> Any:
+    """Неизменяемые контейнеры (MappingProxyType, tuple) -> dict/list для stdlib json"""
+    if isinstance(value, Mapping):
+        return {key: _to_plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_plain(item) for item in value]
+    return value
+
+
+class ToolResult:
+    """
+    Базовый класс результатов инструментов, в dict переводится только при сериализации.
+    frozen=True защищает лишь сами поля, поэтому вложенные значения — tuple и MappingProxyType.
+    """
+    __slots__ = ()
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {f.name: _to_plain(getattr(self, f.name)) for f in fields(self)}
+
+
+@dataclass(frozen=True, slots=True)
+class AudienceResult(ToolResult):
+    product: str
+    industry: str
+    target_segments: tuple[str, ...]
+    demographics: Mapping[str, str]
+    pain_points: tuple[str, ...]
+    recommended_channels: tuple[str, ...]
+    insight: str
+
+
+@dataclass(frozen=True, slots=True)
+class RoiResult(ToolResult):
+    activity_type: str
+    budget: float
+    duration_days: int
+    expected_roi: float
+    estimated_revenue: int
+    estimated_leads: int
+    cost_per_click_range: str
+    confidence: str
+    recommendation: str
+
+
+@dataclass(frozen=True, slots=True)
+class SeasonalityResult(ToolResult):
+    industry: str
+    current_month: str
+    is_peak_season: bool
+    is_low_season: bool
+    peak_months: tuple[str, ...]
+    low_months: tuple[str, ...]
+    key_events: tuple[str, ...]
+    recommendation: str
+
+
+@dataclass(frozen=True, slots=True)
+class ChannelResult(ToolResult):
+    goal: str
+    target_audience_age: str
+    budget_range: str
+    channel_ranking: tuple[Mapping[str, Any], ...]
+    top_recommendation: str
+    insight: str
+
+
+@dataclass(frozen=True, slots=True)
+class BenchmarkResult(ToolResult):
+    industry: str
+    company_size: str
+    avg_marketing_budget_percent_of_revenue: int
+    industry_top_channels: tuple[str, ...]
+    avg_customer_acquisition_cost: int
+    target_ltv_cac_ratio: float
+    insight: str
+
+
+def _json_default(obj: Any) -> Any:
+    """MappingProxyType из справочных таблиц сериализуется как обычный dict"""
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _dump_json(obj: Any) -> str:
+    """Сериализует результат инструмента в компактную JSON-строку (orjson, если доступен)"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_DATACLASS
+        return orjson.dumps(obj, default=_json_default, option=option).decode("utf-8")
+    
+    if isinstance(obj, ToolResult):
+        obj = obj.to_dict()
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+
+
+def _load_json(data: Any) -> Any:
+    """
+    Разбирает JSON из str/bytes (orjson, если доступен).
+    orjson.JSONDecodeError наследуется от json.JSONDecodeError — обработка ошибок не меняется.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
 # ==================== РЕАЛИЗАЦИЯ ИНСТРУМЕНТОВ ====================
 
-def analyze_target_audience(product_or_service: str, industry: str = "общий") -> Dict[str, Any]:
+# Справочные таблицы инструментов (ЦА, сезонность, бенчмарки, оценки каналов) лежат в
+# agent_data.json и загружаются один раз при импорте — до fork() воркеров, чтобы страницы
+# памяти были общими.
+AGENT_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent_data.json")
+
+
+def _freeze_data(obj: Any) -> Any:
+    """
+    Делает таблицы неизменяемыми: dict -> MappingProxyType, list -> tuple.
+    Списки из таблиц попадают в кэшируемые результаты, и правка такого списка
+    у одного вызывающего испортила бы справочник для всех последующих вызовов.
+    Ключи интернируются: одинаковые ключи всех строк — один объект str.
+    """
+    if isinstance(obj, dict):
+        return MappingProxyType({sys.intern(key): _freeze_data(value) for key, value in obj.items()})
+    if isinstance(obj, list):
+        return tuple(_freeze_data(item) for item in obj)
+    return obj
+
+
+def _load_agent_data(path: str) -> Mapping[str, Any]:
+    """Загружает справочные таблицы инструментов"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    data = _load_json(raw)
+    # Ключи из JSON — отдельные объекты; после интернирования они совпадают с литералами
+    # вроде data["primary_segments"] в коде, и поиск в dict срабатывает по identity
+    return _freeze_data(data)
+
+
+_AGENT_DATA = _load_agent_data(AGENT_DATA_PATH)
+
+# Инструменты — чистые функции от аргументов, поэтому результаты кэшируются.
+# Возвращаемые dataclass'ы заморожены вместе с вложенными значениями (tuple, MappingProxyType),
+# поэтому один объект безопасно отдаётся всем вызывающим.
+# typed=True: budget=100 и budget=100.0 дают разные результаты в JSON.
+TOOL_CACHE_SIZE = 2048
+
+# База знаний по отраслям (ключи в нижнем регистре)
+_INDUSTRY_AUDIENCE: Mapping[str, Mapping[str, Any]] = _AGENT_DATA["audience"]
+
+
+@functools.lru_cache(maxsize=TOOL_CACHE_SIZE, typed=True)
+def analyze_target_audience(product_or_service: str, industry: str = "общий") -> AudienceResult:
     """Симуляция анализа целевой аудитории"""
     
-    # База знаний по отраслям
-    industry_data = {
-        "IT": {
-            "primary_segments": ["разработчики", "IT-менеджеры", "CTO/CIO", "стартаперы"],
-            "age_range": "25-45",
-            "income": "выше среднего",
-            "pain_points": ["нехватка времени", "сложность выбора технологий", "масштабирование"],
-            "channels": ["Habr", "LinkedIn", "профильные конференции", "Telegram"]
-        },
-        "ритейл": {
-            "primary_segments": ["владельцы магазинов", "категорийные менеджеры", "байеры"],
-            "age_range": "30-55",
-            "income": "средний-высокий",
-            "pain_points": ["конкуренция с маркетплейсами", "управление ассортиментом", "логистика"],
-            "channels": ["отраслевые выставки", "email", "WhatsApp Business"]
-        },
-        "финансы": {
-            "primary_segments": ["частные инвесторы", "предприниматели", "финансовые директора"],
-            "age_range": "30-55",
-            "income": "высокий",
-            "pain_points": ["риски", "доходность", "надёжность"],
-            "channels": ["деловые СМИ", "LinkedIn", "вебинары"]
-        },
-        "красота": {
-            "primary_segments": ["женщины 25-45", "невесты", "бизнес-леди", "мамы"],
-            "age_range": "20-50",
-            "income": "средний-высокий",
-            "pain_points": ["нехватка времени", "поиск своего мастера", "качество услуг", "цена"],
-            "channels": ["Instagram", "VK", "Яндекс.Карты", "2ГИС", "сарафанное радио"]
-        },
-        "барбершоп": {
-            "primary_segments": ["мужчины 20-40", "хипстеры", "бизнесмены", "молодёжь"],
-            "age_range": "18-45",
-            "income": "средний-высокий",
-            "pain_points": ["очереди", "нестабильное качество", "неудобное расположение"],
-            "channels": ["Instagram", "Telegram", "Яндекс.Карты", "Google Maps", "локальная реклама"]
-        },
-        "медицина": {
-            "primary_segments": ["пациенты 30+", "родители с детьми", "пожилые", "корпоративные клиенты"],
-            "age_range": "25-65",
-            "income": "средний-высокий",
-            "pain_points": ["доверие к врачу", "очереди", "цены", "качество диагностики"],
-            "channels": ["Яндекс.Карты", "ПроДокторов", "сарафанное радио", "контекстная реклама"]
-        },
-        "стоматология": {
-            "primary_segments": ["взрослые 25-55", "родители с детьми", "пациенты с острой болью"],
-            "age_range": "20-60",
-            "income": "средний-высокий",
-            "pain_points": ["страх боли", "цены", "доверие к врачу", "гарантии"],
-            "channels": ["Яндекс.Карты", "контекстная реклама", "Instagram", "сарафанное радио"]
-        },
-        "фитнес": {
-            "primary_segments": ["молодёжь 20-35", "офисные работники", "женщины после родов", "худеющие"],
-            "age_range": "18-45",
-            "income": "средний",
-            "pain_points": ["мотивация", "время", "результат", "цена абонемента"],
-            "channels": ["Instagram", "VK", "Telegram", "локальная реклама", "партнёрства"]
-        },
-        "ресторан": {
-            "primary_segments": ["молодые пары", "компании друзей", "бизнес-ланчи", "семьи"],
-            "age_range": "22-50",
-            "income": "средний-высокий",
-            "pain_points": ["качество еды", "атмосфера", "цены", "время ожидания"],
-            "channels": ["Instagram", "Яндекс.Карты", "TripAdvisor", "локальные блогеры", "Telegram"]
-        },
-        "кафе": {
-            "primary_segments": ["студенты", "фрилансеры", "офисные работники", "мамы с детьми"],
-            "age_range": "18-40",
-            "income": "средний",
-            "pain_points": ["wifi", "розетки", "уютная атмосфера", "качество кофе"],
-            "channels": ["Instagram", "Яндекс.Карты", "локальные паблики", "сарафанное радио"]
-        },
-        "автосервис": {
-            "primary_segments": ["автовладельцы 25-55", "таксисты", "корпоративные клиенты"],
-            "age_range": "25-60",
-            "income": "средний-высокий",
-            "pain_points": ["доверие", "цены", "сроки ремонта", "гарантии", "запчасти"],
-            "channels": ["Яндекс.Карты", "2ГИС", "Drive2", "контекстная реклама", "сарафанное радио"]
-        },
-        "недвижимость": {
-            "primary_segments": ["покупатели квартир", "инвесторы", "арендаторы", "семьи с ипотекой"],
-            "age_range": "25-55",
-            "income": "выше среднего",
-            "pain_points": ["цены", "надёжность застройщика", "локация", "ипотека"],
-            "channels": ["ЦИАН", "Авито", "контекстная реклама", "наружная реклама", "выставки"]
-        },
-        "образование": {
-            "primary_segments": ["студенты", "родители школьников", "специалисты на переквалификации"],
-            "age_range": "16-45",
-            "income": "средний",
-            "pain_points": ["качество обучения", "трудоустройство", "цена", "формат"],
-            "channels": ["VK", "Telegram", "контекстная реклама", "YouTube", "партнёрства с вузами"]
-        },
-        "доставка еды": {
-            "primary_segments": ["офисные работники", "молодёжь", "семьи", "занятые профессионалы"],
-            "age_range": "20-45",
-            "income": "средний",
-            "pain_points": ["скорость доставки", "качество еды", "цены", "минимальный заказ"],
-            "channels": ["агрегаторы (Яндекс.Еда, Delivery)", "Instagram", "Telegram", "промокоды"]
-        },
-        "цветы": {
-            "primary_segments": ["мужчины 25-50", "корпоративные клиенты", "организаторы мероприятий"],
-            "age_range": "22-55",
-            "income": "средний-высокий",
-            "pain_points": ["свежесть", "доставка вовремя", "оригинальность", "цена"],
-            "channels": ["Instagram", "контекстная реклама", "Яндекс.Карты", "партнёрства с ресторанами"]
-        },
-        "юридические услуги": {
-            "primary_segments": ["предприниматели", "физлица с проблемами", "корпоративные клиенты"],
-            "age_range": "30-60",
-            "income": "выше среднего",
-            "pain_points": ["доверие", "цена", "результат", "сроки"],
-            "channels": ["контекстная реклама", "сарафанное радио", "LinkedIn", "профильные форумы"]
-        },
-        "клининг": {
-            "primary_segments": ["занятые профессионалы", "семьи", "офисы", "после ремонта"],
-            "age_range": "25-55",
-            "income": "средний-высокий",
-            "pain_points": ["доверие к персоналу", "качество", "цена", "гибкость графика"],
-            "channels": ["Яндекс.Услуги", "Авито", "контекстная реклама", "сарафанное радио"]
-        },
-        "общий": {
-            "primary_segments": ["широкая аудитория"],
-            "age_range": "18-65",
-            "income": "разный",
-            "pain_points": ["цена", "качество", "удобство"],
-            "channels": ["социальные сети", "контекстная реклама", "email"]
-        }
-    }
-    
-    data = industry_data.get(industry.lower(), industry_data["общий"])
+    data = _INDUSTRY_AUDIENCE.get(industry.lower(), _INDUSTRY_AUDIENCE["общий"])
     
-    return {
-        "product": product_or_service,
-        "industry": industry,
-        "target_segments": data["primary_segments"],
-        "demographics": {
+    return AudienceResult(
+        product=product_or_service,
+        industry=industry,
+        target_segments=data["primary_segments"],
+        demographics=MappingProxyType({
             "age_range": data["age_range"],
             "income_level": data["income"]
-        },
-        "pain_points": data["pain_points"],
-        "recommended_channels": data["channels"],
-        "insight": f"Для продукта '{product_or_service}' в отрасли '{industry}' рекомендуется фокус на сегменты: {', '.join(data['primary_segments'][:2])}"
-    }
+        }),
+        pain_points=data["pain_points"],
+        recommended_channels=data["channels"],
+        insight=f"Для продукта '{product_or_service}' в отрасли '{industry}' рекомендуется фокус на сегменты: {', '.join(data['primary_segments'][:2])}"
+    )
+
+
+@dataclass(frozen=True, slots=True)
+class ActivityBenchmark:
+    """Базовые показатели активности: поля читаются через слоты, а не поиском по dict"""
+    avg_roi: float
+    conversion_rate: float
+    cpc_range: str
+
+
+# Базовые показатели эффективности по типам активностей
+_ACTIVITY_BENCHMARKS: Mapping[str, ActivityBenchmark] = MappingProxyType({
+    "контекстная реклама": ActivityBenchmark(2.5, 0.03, "30-150₽"),
+    "smm": ActivityBenchmark(1.8, 0.015, "5-50₽"),
+    "email-маркетинг": ActivityBenchmark(4.2, 0.025, "1-5₽"),
+    "event": ActivityBenchmark(3.0, 0.1, "500-5000₽"),
+    "influencer": ActivityBenchmark(2.0, 0.02, "50-500₽"),
+    "seo": ActivityBenchmark(5.5, 0.04, "0₽ (органика)"),
+    "контент-маркетинг": ActivityBenchmark(3.8, 0.02, "10-100₽")
+})
+_DEFAULT_ACTIVITY_BENCHMARK = ActivityBenchmark(2.0, 0.02, "varies")
+
+# Все типы активностей ищутся одним регулярным выражением вместо цикла с проверкой вхождения
+_ACTIVITY_REGEX = re.compile("|".join(re.escape(key) for key in _ACTIVITY_BENCHMARKS))
+_ACTIVITY_PRIORITY = {key: i for i, key in enumerate(_ACTIVITY_BENCHMARKS)}
 
+# Суммы округляются заранее: форматирование int дешевле, чем float со спецификатором ",.0f"
+_ROI_RECOMMENDATION = "При бюджете {budget:,}₽ на {activity_type} ожидаемый возврат ~{revenue:,}₽"
 
-def estimate_roi(activity_type: str, budget: float, duration_days: int = 30) -> Dict[str, Any]:
+
+@functools.lru_cache(maxsize=TOOL_CACHE_SIZE, typed=True)
+def estimate_roi(activity_type: str, budget: float, duration_days: int = 30) -> RoiResult:
     """Оценка ROI для различных типов маркетинговых активностей"""
     
-    # Базовые показатели эффективности по типам активностей
-    activity_benchmarks = {
-        "контекстная реклама": {"avg_roi": 2.5, "conversion_rate": 0.03, "cpc_range": "30-150₽"},
-        "smm": {"avg_roi": 1.8, "conversion_rate": 0.015, "cpc_range": "5-50₽"},
-        "email-маркетинг": {"avg_roi": 4.2, "conversion_rate": 0.025, "cpc_range": "1-5₽"},
-        "event": {"avg_roi": 3.0, "conversion_rate": 0.1, "cpc_range": "500-5000₽"},
-        "influencer": {"avg_roi": 2.0, "conversion_rate": 0.02, "cpc_range": "50-500₽"},
-        "seo": {"avg_roi": 5.5, "conversion_rate": 0.04, "cpc_range": "0₽ (органика)"},
-        "контент-маркетинг": {"avg_roi": 3.8, "conversion_rate": 0.02, "cpc_range": "10-100₽"}
-    }
-    
+    # Точное название активности — одно обращение к dict
     activity_lower = activity_type.lower()
-    benchmark = None
-    for key in activity_benchmarks:
-        if key in activity_lower:
-            benchmark = activity_benchmarks[key]
-            break
-    
-    if not benchmark:
-        benchmark = {"avg_roi": 2.0, "conversion_rate": 0.02, "cpc_range": "varies"}
+    benchmark = _ACTIVITY_BENCHMARKS.get(activity_lower)
+    if benchmark is None:
+        # Один проход по строке; при нескольких совпадениях побеждает ключ, стоящий раньше в таблице
+        matches = _ACTIVITY_REGEX.findall(activity_lower)
+        if matches:
+            benchmark = _ACTIVITY_BENCHMARKS[min(matches, key=_ACTIVITY_PRIORITY.__getitem__)]
+        else:
+            benchmark = _DEFAULT_ACTIVITY_BENCHMARK
     
-    estimated_revenue = budget * benchmark["avg_roi"]
-    estimated_leads = int(budget * benchmark["conversion_rate"])
+    avg_roi = benchmark.avg_roi
     
     # Корректировка на длительность
     duration_factor = min(duration_days / 30, 2.0)
+    revenue = round(budget * avg_roi * duration_factor)
+    leads = int(int(budget * benchmark.conversion_rate) * duration_factor)
     
-    return {
-        "activity_type": activity_type,
-        "budget": budget,
-        "duration_days": duration_days,
-        "expected_roi": round(benchmark["avg_roi"] * duration_factor, 2),
-        "estimated_revenue": round(estimated_revenue * duration_factor),
-        "estimated_leads": int(estimated_leads * duration_factor),
-        "cost_per_click_range": benchmark["cpc_range"],
-        "confidence": "средняя",
-        "recommendation": f"При бюджете {budget:,.0f}₽ на {activity_type} ожидаемый возврат ~{estimated_revenue * duration_factor:,.0f}₽"
-    }
+    return RoiResult(
+        activity_type=activity_type,
+        budget=budget,
+        duration_days=duration_days,
+        expected_roi=round(avg_roi * duration_factor, 2),
+        estimated_revenue=revenue,
+        estimated_leads=leads,
+        cost_per_click_range=benchmark.cpc_range,
+        confidence="средняя",
+        recommendation=_ROI_RECOMMENDATION.format(budget=round(budget), activity_type=activity_type, revenue=revenue)
+    )
 
 
-def analyze_seasonality(industry: str, current_month: str = "декабрь") -> Dict[str, Any]:
-    """Анализ сезонности для отрасли"""
+# Сезонность по отраслям (ключи в нижнем регистре)
+_SEASONALITY_DATA: Mapping[str, Mapping[str, Any]] = _AGENT_DATA["seasonality"]
+
+_DEFAULT_SEASONALITY_DATA = {
+    "peak_months": ["март", "сентябрь", "ноябрь"],
+    "low_months": ["январь", "июль"],
+    "events": ["общие праздники"]
+}
+
+
+@dataclass(frozen=True, slots=True)
+class SeasonRow:
+    """Строка таблицы сезонности с месяцами в нижнем регистре для O(1) проверки пика/спада"""
+    peak_set: frozenset
+    low_set: frozenset
+    peak_months: tuple[str, ...]
+    low_months: tuple[str, ...]
+    events: tuple[str, ...]
     
-    seasonality_data = {
-        "ритейл": {
-            "peak_months": ["ноябрь", "декабрь", "март"],
-            "low_months": ["январь", "февраль", "июль"],
-            "events": ["Чёрная пятница", "Новый год", "8 марта", "Back to school"]
-        },
-        "IT": {
-            "peak_months": ["сентябрь", "октябрь", "март"],
-            "low_months": ["июль", "август", "январь"],
-            "events": ["бюджетирование Q4", "конференции осенью", "старт проектов весной"]
-        },
-        "туризм": {
-            "peak_months": ["июнь", "июль", "август", "декабрь"],
-            "low_months": ["ноябрь", "март", "апрель"],
-            "events": ["летний сезон", "новогодние каникулы", "майские праздники"]
-        },
-        "образование": {
-            "peak_months": ["август", "сентябрь", "январь"],
-            "low_months": ["июнь", "июль", "декабрь"],
-            "events": ["начало учебного года", "курсы повышения квалификации"]
-        },
-        "красота": {
-            "peak_months": ["март", "апрель", "май", "декабрь"],
-            "low_months": ["январь", "февраль", "август"],
-            "events": ["8 марта", "выпускные", "свадебный сезон", "Новый год"]
-        },
-        "барбершоп": {
-            "peak_months": ["декабрь", "май", "сентябрь"],
-            "low_months": ["январь", "февраль", "июль"],
-            "events": ["Новый год", "выпускные", "начало делового сезона"]
-        },
-        "медицина": {
-            "peak_months": ["сентябрь", "октябрь", "март", "апрель"],
-            "low_months": ["июль", "август", "январь"],
-            "events": ["диспансеризация", "сезон простуд", "подготовка к лету"]
-        },
-        "стоматология": {
-            "peak_months": ["апрель", "май", "октябрь", "ноябрь"],
-            "low_months": ["июль", "август", "январь"],
-            "events": ["перед отпусками", "перед праздниками", "профосмотры"]
-        },
-        "фитнес": {
-            "peak_months": ["январь", "сентябрь", "март", "апрель"],
-            "low_months": ["июль", "август", "декабрь"],
-            "events": ["новогодние обещания", "подготовка к лету", "после отпусков"]
-        },
-        "ресторан": {
-            "peak_months": ["декабрь", "февраль", "март", "май"],
-            "low_months": ["январь", "июль", "август"],
-            "events": ["корпоративы", "14 февраля", "8 марта", "выпускные"]
-        },
-        "кафе": {
-            "peak_months": ["сентябрь", "октябрь", "ноябрь", "март"],
-            "low_months": ["июль", "август", "январь"],
-            "events": ["начало учебного года", "холодный сезон"]
-        },
-        "автосервис": {
-            "peak_months": ["март", "апрель", "октябрь", "ноябрь"],
-            "low_months": ["январь", "июль", "август"],
-            "events": ["смена резины весна", "смена резины осень", "подготовка к зиме"]
-        },
-        "недвижимость": {
-            "peak_months": ["март", "апрель", "сентябрь", "октябрь"],
-            "low_months": ["январь", "июль", "август", "декабрь"],
-            "events": ["после НГ активность", "перед учебным годом"]
-        },
-        "цветы": {
-            "peak_months": ["февраль", "март", "сентябрь"],
-            "low_months": ["январь", "июль", "ноябрь"],
-            "events": ["14 февраля", "8 марта", "1 сентября", "День учителя"]
-        },
-        "доставка еды": {
-            "peak_months": ["ноябрь", "декабрь", "февраль", "март"],
-            "low_months": ["июнь", "июль", "август"],
-            "events": ["холодный сезон", "праздники", "плохая погода"]
-        },
-        "клининг": {
-            "peak_months": ["апрель", "май", "декабрь"],
-            "low_months": ["январь", "февраль", "июль"],
-            "events": ["генеральная уборка весной", "перед НГ"]
-        }
-    }
+    @classmethod
+    def from_data(cls, data: Dict[str, Any]) -> "SeasonRow":
+        return cls(
+            peak_set=frozenset(m.lower() for m in data["peak_months"]),
+            low_set=frozenset(m.lower() for m in data["low_months"]),
+            peak_months=tuple(data["peak_months"]),
+            low_months=tuple(data["low_months"]),
+            events=tuple(data["events"])
+        )
+
+
+_SEASONALITY: Mapping[str, SeasonRow] = MappingProxyType(
+    {key: SeasonRow.from_data(data) for key, data in _SEASONALITY_DATA.items()}
+)
+_DEFAULT_SEASON_ROW = SeasonRow.from_data(_DEFAULT_SEASONALITY_DATA)
+
+
+@functools.lru_cache(maxsize=TOOL_CACHE_SIZE, typed=True)
+def analyze_seasonality(industry: str, current_month: str = "декабрь") -> SeasonalityResult:
+    """Анализ сезонности для отрасли"""
     
-    data = seasonality_data.get(industry.lower(), {
-        "peak_months": ["март", "сентябрь", "ноябрь"],
-        "low_months": ["январь", "июль"],
-        "events": ["общие праздники"]
-    })
+    row = _SEASONALITY.get(industry.lower(), _DEFAULT_SEASON_ROW)
     
-    is_peak = current_month.lower() in [m.lower() for m in data["peak_months"]]
-    is_low = current_month.lower() in [m.lower() for m in data["low_months"]]
+    month = current_month.lower()
+    is_peak = month in row.peak_set
+    is_low = month in row.low_set
     
-    return {
-        "industry": industry,
-        "current_month": current_month,
-        "is_peak_season": is_peak,
-        "is_low_season": is_low,
-        "peak_months": data["peak_months"],
-        "low_months": data["low_months"],
-        "key_events": data["events"],
-        "recommendation": "Отличное время для активных кампаний!" if is_peak else 
-                         "Рекомендуется подготовительная работа и тестирование" if is_low else
-                         "Стандартный период, подходит для планомерной работы"
-    }
+    return SeasonalityResult(
+        industry=industry,
+        current_month=current_month,
+        is_peak_season=is_peak,
+        is_low_season=is_low,
+        peak_months=row.peak_months,
+        low_months=row.low_months,
+        key_events=row.events,
+        recommendation="Отличное время для активных кампаний!" if is_peak else 
+                       "Рекомендуется подготовительная работа и тестирование" if is_low else
+                       "Стандартный период, подходит для планомерной работы"
+    )
+
+
+# Оценки каналов (1-10) по целям
+_CHANNEL_SCORES: Mapping[str, Mapping[str, int]] = _AGENT_DATA["channel_scores"]
+
+
+def _rank_channels(scores: Mapping[str, int]) -> tuple[tuple[Mapping[str, Any], ...], tuple[str, int]]:
+    """Топ-5 каналов по эффективности и лучший канал"""
+    sorted_channels = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    ranking = tuple(MappingProxyType({"channel": ch, "score": sc, "priority": i+1})
+                    for i, (ch, sc) in enumerate(sorted_channels[:5]))
+    return ranking, sorted_channels[0]
+
+
+# Рейтинги каналов не зависят от аргументов — сортируем один раз при импорте
+_CHANNEL_RANKINGS = MappingProxyType({goal: _rank_channels(scores) for goal, scores in _CHANNEL_SCORES.items()})
 
 
-def channel_effectiveness(goal: str, target_audience_age: str = "25-34", budget_range: str = "средний") -> Dict[str, Any]:
+@functools.lru_cache(maxsize=TOOL_CACHE_SIZE, typed=True)
+def channel_effectiveness(goal: str, target_audience_age: str = "25-34", budget_range: str = "средний") -> ChannelResult:
     """Оценка эффективности каналов"""
     
-    channel_scores = {
-        "awareness": {
-            "YouTube": 9, "TikTok": 8, "Instagram": 8, "VK": 7, 
-            "Telegram": 6, "контекстная реклама": 5, "наружная реклама": 7
-        },
-        "leads": {
-            "контекстная реклама": 9, "LinkedIn": 8, "email": 7, 
-            "вебинары": 8, "Telegram": 6, "SEO": 7
-        },
-        "sales": {
-            "контекстная реклама": 9, "ремаркетинг": 9, "email": 8,
-            "маркетплейсы": 8, "партнёрки": 7
-        },
-        "retention": {
-            "email": 9, "push-уведомления": 8, "программы лояльности": 9,
-            "Telegram": 7, "SMS": 6
-        }
-    }
+    ranking, (top_channel, top_score) = _CHANNEL_RANKINGS.get(goal.lower(), _CHANNEL_RANKINGS["leads"])
     
-    scores = channel_scores.get(goal.lower(), channel_scores["leads"])
-    
-    # Сортируем по эффективности
-    sorted_channels = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    
-    return {
-        "goal": goal,
-        "target_audience_age": target_audience_age,
-        "budget_range": budget_range,
-        "channel_ranking": [{"channel": ch, "score": sc, "priority": i+1} 
-                           for i, (ch, sc) in enumerate(sorted_channels[:5])],
-        "top_recommendation": sorted_channels[0][0],
-        "insight": f"Для цели '{goal}' топ-канал: {sorted_channels[0][0]} (эффективность {sorted_channels[0][1]}/10)"
-    }
+    return ChannelResult(
+        goal=goal,
+        target_audience_age=target_audience_age,
+        budget_range=budget_range,
+        channel_ranking=ranking,
+        top_recommendation=top_channel,
+        insight=f"Для цели '{goal}' топ-канал: {top_channel} (эффективность {top_score}/10)"
+    )
 
 
-def competitor_benchmark(industry: str, company_size: str = "средний") -> Dict[str, Any]:
+# Бенчмарки по отраслям (ищутся по вхождению в описание отрасли)
+_BENCHMARKS: Mapping[str, Mapping[str, Any]] = _AGENT_DATA["benchmarks"]
+
+_DEFAULT_BENCHMARK = {
+    "avg_marketing_budget_percent": 10,
+    "top_channels": ("digital-реклама", "SMM", "контент"),
+    "avg_cac": 5000,
+    "avg_ltv_cac_ratio": 3.0
+}
+
+_BENCHMARK_SIZE_MULTIPLIERS = MappingProxyType({"малый": 0.7, "средний": 1.0, "крупный": 1.5})
+
+# Точные названия отраслей и их синонимы -> ключ в _BENCHMARKS.
+# Поиск по вхождению остаётся запасным вариантом для свободного текста.
+_BENCHMARK_ALIASES = {key.lower(): key for key in _BENCHMARKS}
+_BENCHMARK_ALIASES.update({
+    "айти": "IT",
+    "ит": "IT",
+    "it-компания": "IT",
+    "розница": "ритейл",
+    "салон красоты": "красота",
+    "стоматолог": "стоматология",
+    "фитнес-клуб": "фитнес",
+    "кофейня": "кафе",
+    "автомастерская": "автосервис",
+    "доставка": "доставка еды",
+    "цветочный магазин": "цветы",
+    "юрист": "юридические услуги",
+    "уборка": "клининг",
+})
+_BENCHMARK_ALIASES = MappingProxyType(_BENCHMARK_ALIASES)
+
+
+@functools.lru_cache(maxsize=TOOL_CACHE_SIZE, typed=True)
+def competitor_benchmark(industry: str, company_size: str = "средний") -> BenchmarkResult:
     """Бенчмарки по отрасли"""
     
-    benchmarks = {
-        "IT": {
-            "avg_marketing_budget_percent": 12,
-            "top_channels": ["контент-маркетинг", "конференции", "LinkedIn"],
-            "avg_cac": 15000,
-            "avg_ltv_cac_ratio": 3.5
-        },
-        "ритейл": {
-            "avg_marketing_budget_percent": 8,
-            "top_channels": ["контекстная реклама", "SMM", "email"],
-            "avg_cac": 500,
-            "avg_ltv_cac_ratio": 4.0
-        },
-        "финансы": {
-            "avg_marketing_budget_percent": 15,
-            "top_channels": ["контент", "вебинары", "партнёрства"],
-            "avg_cac": 25000,
-            "avg_ltv_cac_ratio": 5.0
-        },
-        "красота": {
-            "avg_marketing_budget_percent": 10,
-            "top_channels": ["Instagram", "Яндекс.Карты", "сарафанное радио"],
-            "avg_cac": 800,
-            "avg_ltv_cac_ratio": 6.0
-        },
-        "барбершоп": {
-            "avg_marketing_budget_percent": 8,
-            "top_channels": ["Instagram", "Яндекс.Карты", "локальная реклама"],
-            "avg_cac": 500,
-            "avg_ltv_cac_ratio": 8.0
-        },
-        "медицина": {
-            "avg_marketing_budget_percent": 6,
-            "top_channels": ["Яндекс.Карты", "ПроДокторов", "контекстная реклама"],
-            "avg_cac": 3000,
-            "avg_ltv_cac_ratio": 5.0
-        },
-        "стоматология": {
-            "avg_marketing_budget_percent": 8,
-            "top_channels": ["Яндекс.Карты", "контекстная реклама", "сарафанное радио"],
-            "avg_cac": 4000,
-            "avg_ltv_cac_ratio": 4.0
-        },
-        "фитнес": {
-            "avg_marketing_budget_percent": 12,
-            "top_channels": ["Instagram", "таргет VK", "партнёрства"],
-            "avg_cac": 1500,
-            "avg_ltv_cac_ratio": 3.0
-        },
-        "ресторан": {
-            "avg_marketing_budget_percent": 5,
-            "top_channels": ["Instagram", "Яндекс.Карты", "локальные блогеры"],
-            "avg_cac": 300,
-            "avg_ltv_cac_ratio": 5.0
-        },
-        "кафе": {
-            "avg_marketing_budget_percent": 4,
-            "top_channels": ["Instagram", "Яндекс.Карты", "локальные паблики"],
-            "avg_cac": 150,
-            "avg_ltv_cac_ratio": 6.0
-        },
-        "автосервис": {
-            "avg_marketing_budget_percent": 5,
-            "top_channels": ["Яндекс.Карты", "2ГИС", "контекстная реклама"],
-            "avg_cac": 2000,
-            "avg_ltv_cac_ratio": 4.0
-        },
-        "недвижимость": {
-            "avg_marketing_budget_percent": 3,
-            "top_channels": ["ЦИАН", "Авито", "контекстная реклама", "наружка"],
-            "avg_cac": 50000,
-            "avg_ltv_cac_ratio": 2.0
-        },
-        "образование": {
-            "avg_marketing_budget_percent": 15,
-            "top_channels": ["контекстная реклама", "VK", "YouTube"],
-            "avg_cac": 5000,
-            "avg_ltv_cac_ratio": 3.0
-        },
-        "цветы": {
-            "avg_marketing_budget_percent": 10,
-            "top_channels": ["Instagram", "контекстная реклама", "Яндекс.Карты"],
-            "avg_cac": 400,
-            "avg_ltv_cac_ratio": 3.0
-        },
-        "доставка еды": {
-            "avg_marketing_budget_percent": 20,
-            "top_channels": ["агрегаторы", "Instagram", "промокоды"],
-            "avg_cac": 200,
-            "avg_ltv_cac_ratio": 4.0
-        },
-        "клининг": {
-            "avg_marketing_budget_percent": 8,
-            "top_channels": ["Яндекс.Услуги", "Авито", "контекстная реклама"],
-            "avg_cac": 1000,
-            "avg_ltv_cac_ratio": 5.0
-        },
-        "юридические услуги": {
-            "avg_marketing_budget_percent": 10,
-            "top_channels": ["контекстная реклама", "сарафанное радио", "SEO"],
-            "avg_cac": 8000,
-            "avg_ltv_cac_ratio": 4.0
-        }
-    }
-    
     # Ищем по ключевым словам
     industry_lower = industry.lower()
-    data = None
-    for key in benchmarks:
-        if key in industry_lower or industry_lower in key:
-            data = benchmarks[key]
-            break
-    
-    if not data:
-        data = {
-            "avg_marketing_budget_percent": 10,
-            "top_channels": ["digital-реклама", "SMM", "контент"],
-            "avg_cac": 5000,
-            "avg_ltv_cac_ratio": 3.0
-        }
+    key = _BENCHMARK_ALIASES.get(industry_lower.strip())
+    if key is None:
+        for candidate in _BENCHMARKS:
+            if candidate in industry_lower or industry_lower in candidate:
+                key = candidate
+                break
+    data = _BENCHMARKS[key] if key is not None else _DEFAULT_BENCHMARK
     
     # Корректировка на размер компании
-    size_multiplier = {"малый": 0.7, "средний": 1.0, "крупный": 1.5}.get(company_size.lower(), 1.0)
+    size_multiplier = _BENCHMARK_SIZE_MULTIPLIERS.get(company_size.lower(), 1.0)
     
-    return {
-        "industry": industry,
-        "company_size": company_size,
-        "avg_marketing_budget_percent_of_revenue": data["avg_marketing_budget_percent"],
-        "industry_top_channels": data["top_channels"],
-        "avg_customer_acquisition_cost": int(data["avg_cac"] * size_multiplier),
-        "target_ltv_cac_ratio": data["avg_ltv_cac_ratio"],
-        "insight": f"Компании в отрасли '{industry}' тратят ~{data['avg_marketing_budget_percent']}% выручки на маркетинг"
+    return BenchmarkResult(
+        industry=industry,
+        company_size=company_size,
+        avg_marketing_budget_percent_of_revenue=data["avg_marketing_budget_percent"],
+        industry_top_channels=data["top_channels"],
+        avg_customer_acquisition_cost=int(data["avg_cac"] * size_multiplier),
+        target_ltv_cac_ratio=data["avg_ltv_cac_ratio"],
+        insight=f"Компании в отрасли '{industry}' тратят ~{data['avg_marketing_budget_percent']}% выручки на маркетинг"
+    )
+
+
+# Рекомендуемые доли бюджета по каналам для каждой цели
+_ALLOCATIONS: Mapping[str, Dict[str, float]] = MappingProxyType({
+    "awareness": {
+        "digital-реклама": 0.35,
+        "SMM": 0.25,
+        "контент": 0.15,
+        "influencer": 0.15,
+        "PR": 0.10
+    },
+    "leads": {
+        "контекстная реклама": 0.40,
+        "SEO/контент": 0.20,
+        "email": 0.15,
+        "вебинары/events": 0.15,
+        "ремаркетинг": 0.10
+    },
+    "sales": {
+        "performance-реклама": 0.45,
+        "ремаркетинг": 0.20,
+        "email": 0.15,
+        "партнёрские программы": 0.10,
+        "CRM-маркетинг": 0.10
+    },
+    "retention": {
+        "email/CRM": 0.35,
+        "программа лояльности": 0.25,
+        "контент": 0.15,
+        "SMM": 0.15,
+        "push/SMS": 0.10
     }
+})
+
+# Канал с наибольшей долей для каждой цели — таблица статична, считаем один раз
+_TOP_PRIORITY = MappingProxyType({goal: max(shares, key=shares.get) for goal, shares in _ALLOCATIONS.items()})
+
+# Строки распределения (канал, процент, доля): процент не пересчитывается на каждый вызов
+_ALLOCATION_ROWS = MappingProxyType({
+    goal: tuple((channel, int(pct * 100), pct) for channel, pct in shares.items())
+    for goal, shares in _ALLOCATIONS.items()
+})
 
 
 def budget_allocator(total_budget: float, primary_goal: str, industry: str = "общий") -> Dict[str, Any]:
     """Рекомендации по распределению бюджета"""
     
-    allocations = {
-        "awareness": {
-            "digital-реклама": 0.35,
-            "SMM": 0.25,
-            "контент": 0.15,
-            "influencer": 0.15,
-            "PR": 0.10
-        },
-        "leads": {
-            "контекстная реклама": 0.40,
-            "SEO/контент": 0.20,
-            "email": 0.15,
-            "вебинары/events": 0.15,
-            "ремаркетинг": 0.10
-        },
-        "sales": {
-            "performance-реклама": 0.45,
-            "ремаркетинг": 0.20,
-            "email": 0.15,
-            "партнёрские программы": 0.10,
-            "CRM-маркетинг": 0.10
-        },
-        "retention": {
-            "email/CRM": 0.35,
-            "программа лояльности": 0.25,
-            "контент": 0.15,
-            "SMM": 0.15,
-            "push/SMS": 0.10
-        }
-    }
-    
-    allocation = allocations.get(primary_goal.lower(), allocations["leads"])
+    goal_key = primary_goal.lower()
+    if goal_key not in _ALLOCATION_ROWS:
+        goal_key = "leads"
     
     budget_breakdown = {
         channel: {
-            "percent": int(pct * 100),
+            "percent": percent,
             "amount": round(total_budget * pct)
         }
-        for channel, pct in allocation.items()
+        for channel, percent, pct in _ALLOCATION_ROWS[goal_key]
     }
     
     return {
@@ -811,69 +836,96 @@ def budget_allocator(total_budget: float, primary_goal: str, industry: str = "о
         "primary_goal": primary_goal,
         "industry": industry,
         "allocation": budget_breakdown,
-        "top_priority_channel": max(allocation.items(), key=lambda x: x[1])[0],
+        "top_priority_channel": _TOP_PRIORITY[goal_key],
         "insight": f"Рекомендуемое распределение {total_budget:,.0f}₽ для цели '{primary_goal}'"
     }
 
 
+# Базовые CAC (стоимость привлечения клиента) по отраслям
+_INDUSTRY_CAC: Mapping[str, Dict[str, int]] = MappingProxyType({
+    "IT": {"min": 10000, "avg": 15000, "max": 25000},
+    "ритейл": {"min": 300, "avg": 500, "max": 1000},
+    "финансы": {"min": 15000, "avg": 25000, "max": 50000},
+    "образование": {"min": 2000, "avg": 5000, "max": 10000},
+    "edtech": {"min": 2000, "avg": 5000, "max": 10000},
+    "saas": {"min": 8000, "avg": 15000, "max": 30000},
+    "b2b": {"min": 10000, "avg": 20000, "max": 40000},
+    "e-commerce": {"min": 200, "avg": 400, "max": 800},
+    "красота": {"min": 500, "avg": 800, "max": 1500},
+    "барбершоп": {"min": 300, "avg": 500, "max": 1000},
+    "салон": {"min": 500, "avg": 800, "max": 1500},
+    "медицина": {"min": 2000, "avg": 3000, "max": 5000},
+    "стоматология": {"min": 3000, "avg": 4000, "max": 6000},
+    "фитнес": {"min": 1000, "avg": 1500, "max": 2500},
+    "ресторан": {"min": 200, "avg": 300, "max": 500},
+    "кафе": {"min": 100, "avg": 150, "max": 300},
+    "автосервис": {"min": 1500, "avg": 2000, "max": 3000},
+    "недвижимость": {"min": 30000, "avg": 50000, "max": 100000},
+    "цветы": {"min": 300, "avg": 400, "max": 600},
+    "доставка": {"min": 150, "avg": 200, "max": 350},
+    "клининг": {"min": 800, "avg": 1000, "max": 1500},
+    "юридические": {"min": 5000, "avg": 8000, "max": 15000},
+    "туризм": {"min": 1000, "avg": 2000, "max": 4000},
+})
+_DEFAULT_CAC = {"min": 3000, "avg": 7000, "max": 15000}
+
+# Все отрасли ищутся одним выражением; lookahead находит и перекрывающиеся вхождения,
+# поэтому, как и в исходном цикле, побеждает ключ, стоящий раньше в таблице
+_INDUSTRY_CAC_REGEX = re.compile("(?=(" + "|".join(re.escape(key) for key in _INDUSTRY_CAC) + "))")
+_INDUSTRY_CAC_PRIORITY = {key: i for i, key in enumerate(_INDUSTRY_CAC)}
+# Точное название отрасли (в т.ч. "IT" в любом регистре) находится одним обращением к dict
+_INDUSTRY_CAC_BY_LOWER = MappingProxyType({key.lower(): data for key, data in _INDUSTRY_CAC.items()})
+
+
+# Множители по целям
+_GOAL_MULTIPLIERS = MappingProxyType({
+    "awareness": 0.5,  # awareness дешевле, но без прямых конверсий
+    "leads": 1.0,
+    "sales": 1.3,
+    "retention": 0.4
+})
+
+# Множители по размеру компании
+_SIZE_MULTIPLIERS = MappingProxyType({
+    "стартап": 0.5,
+    "малый": 0.7,
+    "средний": 1.0,
+    "крупный": 2.0
+})
+
+# Базовые бюджеты без целевого количества лидов
+_BASE_BUDGETS = MappingProxyType({
+    "стартап": {"min": 50000, "optimal": 150000, "max": 300000},
+    "малый": {"min": 100000, "optimal": 300000, "max": 500000},
+    "средний": {"min": 300000, "optimal": 700000, "max": 1500000},
+    "крупный": {"min": 1000000, "optimal": 3000000, "max": 10000000}
+})
+
+
 def estimate_budget(goal: str, industry: str, target_leads: int = None, company_size: str = "средний") -> Dict[str, Any]:
     """Оценка рекомендуемого бюджета для кампании"""
     
-    # Базовые CAC (стоимость привлечения клиента) по отраслям
-    industry_cac = {
-        "IT": {"min": 10000, "avg": 15000, "max": 25000},
-        "ритейл": {"min": 300, "avg": 500, "max": 1000},
-        "финансы": {"min": 15000, "avg": 25000, "max": 50000},
-        "образование": {"min": 2000, "avg": 5000, "max": 10000},
-        "edtech": {"min": 2000, "avg": 5000, "max": 10000},
-        "saas": {"min": 8000, "avg": 15000, "max": 30000},
-        "b2b": {"min": 10000, "avg": 20000, "max": 40000},
-        "e-commerce": {"min": 200, "avg": 400, "max": 800},
-        "красота": {"min": 500, "avg": 800, "max": 1500},
-        "барбершоп": {"min": 300, "avg": 500, "max": 1000},
-        "салон": {"min": 500, "avg": 800, "max": 1500},
-        "медицина": {"min": 2000, "avg": 3000, "max": 5000},
-        "стоматология": {"min": 3000, "avg": 4000, "max": 6000},
-        "фитнес": {"min": 1000, "avg": 1500, "max": 2500},
-        "ресторан": {"min": 200, "avg": 300, "max": 500},
-        "кафе": {"min": 100, "avg": 150, "max": 300},
-        "автосервис": {"min": 1500, "avg": 2000, "max": 3000},
-        "недвижимость": {"min": 30000, "avg": 50000, "max": 100000},
-        "цветы": {"min": 300, "avg": 400, "max": 600},
-        "доставка": {"min": 150, "avg": 200, "max": 350},
-        "клининг": {"min": 800, "avg": 1000, "max": 1500},
-        "юридические": {"min": 5000, "avg": 8000, "max": 15000},
-        "туризм": {"min": 1000, "avg": 2000, "max": 4000},
-    }
-    
-    # Множители по целям
-    goal_multipliers = {
-        "awareness": 0.5,  # awareness дешевле, но без прямых конверсий
-        "leads": 1.0,
-        "sales": 1.3,
-        "retention": 0.4
-    }
-    
-    # Множители по размеру компании
-    size_multipliers = {
-        "стартап": 0.5,
-        "малый": 0.7,
-        "средний": 1.0,
-        "крупный": 2.0
-    }
+    # Кэшированный словарь общий для всех вызовов — наружу отдаём копию
+    result = _estimate_budget_cached(goal, industry, target_leads, company_size)
+    return {**result, "budget_recommendations": dict(result["budget_recommendations"])}
+
+
+@functools.lru_cache(maxsize=TOOL_CACHE_SIZE, typed=True)
+def _estimate_budget_cached(goal: str, industry: str, target_leads: Optional[int], company_size: str) -> Dict[str, Any]:
+    """Расчёт для estimate_budget; возвращаемый словарь разделяется между вызовами"""
     
-    # Получаем базовые значения
+    # Получаем базовые значения: сначала точное совпадение, затем поиск по вхождению
     industry_lower = industry.lower()
-    cac_data = None
-    for key in industry_cac:
-        if key in industry_lower:
-            cac_data = industry_cac[key]
-            break
-    if not cac_data:
-        cac_data = {"min": 3000, "avg": 7000, "max": 15000}
+    cac_data = _INDUSTRY_CAC_BY_LOWER.get(industry_lower)
+    if cac_data is None:
+        matches = _INDUSTRY_CAC_REGEX.findall(industry_lower)
+        if matches:
+            cac_data = _INDUSTRY_CAC[min(matches, key=_INDUSTRY_CAC_PRIORITY.__getitem__)]
+        else:
+            cac_data = _DEFAULT_CAC
     
-    goal_mult = goal_multipliers.get(goal.lower(), 1.0)
-    size_mult = size_multipliers.get(company_size.lower(), 1.0)
+    goal_mult = _GOAL_MULTIPLIERS.get(goal.lower(), 1.0)
+    size_mult = _SIZE_MULTIPLIERS.get(company_size.lower(), 1.0)
     
     # Рассчитываем бюджеты
     if target_leads:
@@ -882,13 +934,7 @@ def estimate_budget(goal: str, industry: str, target_leads: int = None, company_
         max_budget = int(target_leads * cac_data["max"] * goal_mult * size_mult)
     else:
         # Базовые рекомендации без целевого количества лидов
-        base_budgets = {
-            "стартап": {"min": 50000, "optimal": 150000, "max": 300000},
-            "малый": {"min": 100000, "optimal": 300000, "max": 500000},
-            "средний": {"min": 300000, "optimal": 700000, "max": 1500000},
-            "крупный": {"min": 1000000, "optimal": 3000000, "max": 10000000}
-        }
-        base = base_budgets.get(company_size.lower(), base_budgets["средний"])
+        base = _BASE_BUDGETS.get(company_size.lower(), _BASE_BUDGETS["средний"])
         min_budget = int(base["min"] * goal_mult)
         optimal_budget = int(base["optimal"] * goal_mult)
         max_budget = int(base["max"] * goal_mult)
@@ -919,23 +965,52 @@ def estimate_budget(goal: str, industry: str, target_leads: int = None, company_
     }
 
 
+# Базовые сроки по целям (в днях)
+_GOAL_DURATIONS = MappingProxyType({
+    "awareness": {"min": 30, "optimal": 90, "max": 180, "description": "Для узнаваемости нужно время на охват и частотность"},
+    "leads": {"min": 14, "optimal": 45, "max": 90, "description": "Лидогенерация требует тестирования и оптимизации"},
+    "sales": {"min": 7, "optimal": 30, "max": 60, "description": "Продажи можно генерировать быстро при правильной настройке"},
+    "retention": {"min": 30, "optimal": 90, "max": 365, "description": "Удержание — долгосрочная стратегия"}
+})
+
+# Корректировки по срочности
+_URGENCY_MULTIPLIERS = MappingProxyType({
+    "срочно": 0.5,
+    "стандартно": 1.0,
+    "долгосрочно": 2.0
+})
+
+# Оптимальные месяцы для старта (если известна отрасль)
+_BEST_START_MONTHS = MappingProxyType({
+    "IT": ("январь", "сентябрь"),
+    "ритейл": ("сентябрь", "октябрь"),
+    "образование": ("август", "январь"),
+    "финансы": ("январь", "апрель", "сентябрь")
+})
+_DEFAULT_START_MONTHS = ("любой месяц",)
+
+# Перевод дней в читаемый формат: границы диапазонов и (шаблон, делитель) для каждого из них
+_DAYS_THRESHOLDS = (14, 30, 90)
+_DAYS_FORMATS = (("{} дней", 1), ("{} недели", 7), ("{} месяц(а)", 30), ("{} месяцев", 30))
+
+
+def _days_to_readable(days: int) -> str:
+    """Переводит длительность в днях в читаемый вид: дни, недели или месяцы"""
+    template, divisor = _DAYS_FORMATS[bisect.bisect_right(_DAYS_THRESHOLDS, days)]
+    return template.format(days // divisor)
+
+
 def estimate_campaign_duration(goal: str, budget: float = None, industry: str = "общий", urgency: str = "стандартно") -> Dict[str, Any]:
     """Оценка рекомендуемой длительности кампании"""
     
-    # Базовые сроки по целям (в днях)
-    goal_durations = {
-        "awareness": {"min": 30, "optimal": 90, "max": 180, "description": "Для узнаваемости нужно время на охват и частотность"},
-        "leads": {"min": 14, "optimal": 45, "max": 90, "description": "Лидогенерация требует тестирования и оптимизации"},
-        "sales": {"min": 7, "optimal": 30, "max": 60, "description": "Продажи можно генерировать быстро при правильной настройке"},
-        "retention": {"min": 30, "optimal": 90, "max": 365, "description": "Удержание — долгосрочная стратегия"}
-    }
-    
-    # Корректировки по срочности
-    urgency_multipliers = {
-        "срочно": 0.5,
-        "стандартно": 1.0,
-        "долгосрочно": 2.0
-    }
+    # Кэшированный словарь общий для всех вызовов — наружу отдаём копию
+    result = _estimate_campaign_duration_cached(goal, budget, industry, urgency)
+    return {**result, "duration_recommendations": dict(result["duration_recommendations"])}
+
+
+@functools.lru_cache(maxsize=TOOL_CACHE_SIZE, typed=True)
+def _estimate_campaign_duration_cached(goal: str, budget: Optional[float], industry: str, urgency: str) -> Dict[str, Any]:
+    """Расчёт для estimate_campaign_duration; возвращаемый словарь разделяется между вызовами"""
     
     # Корректировки по бюджету (если указан)
     budget_factor = 1.0
@@ -953,34 +1028,15 @@ def estimate_campaign_duration(goal: str, budget: float = None, industry: str =
         budget_note = "Бюджет не указан, рекомендации на основе цели"
     
     # Получаем базовые значения
-    durations = goal_durations.get(goal.lower(), goal_durations["leads"])
-    urgency_mult = urgency_multipliers.get(urgency.lower(), 1.0)
+    durations = _GOAL_DURATIONS.get(goal.lower(), _GOAL_DURATIONS["leads"])
+    urgency_mult = _URGENCY_MULTIPLIERS.get(urgency.lower(), 1.0)
     
     # Рассчитываем сроки
     min_days = int(durations["min"] * urgency_mult * budget_factor)
     optimal_days = int(durations["optimal"] * urgency_mult * budget_factor)
     max_days = int(durations["max"] * urgency_mult * budget_factor)
     
-    # Переводим в читаемый формат
-    def days_to_readable(days):
-        if days < 14:
-            return f"{days} дней"
-        elif days < 30:
-            return f"{days // 7} недели"
-        elif days < 90:
-            return f"{days // 30} месяц(а)"
-        else:
-            return f"{days // 30} месяцев"
-    
-    # Оптимальные месяцы для старта (если известна отрасль)
-    best_start_months = {
-        "IT": ["январь", "сентябрь"],
-        "ритейл": ["сентябрь", "октябрь"],
-        "образование": ["август", "январь"],
-        "финансы": ["январь", "апрель", "сентябрь"]
-    }
-    
-    start_recommendation = best_start_months.get(industry, ["любой месяц"])
+    start_recommendation = _BEST_START_MONTHS.get(industry, _DEFAULT_START_MONTHS)
     
     return {
         "goal": goal,
@@ -991,14 +1047,14 @@ def estimate_campaign_duration(goal: str, budget: float = None, industry: str =
             "minimum_days": min_days,
             "optimal_days": optimal_days,
             "maximum_days": max_days,
-            "minimum_readable": days_to_readable(min_days),
-            "optimal_readable": days_to_readable(optimal_days),
-            "maximum_readable": days_to_readable(max_days)
+            "minimum_readable": _days_to_readable(min_days),
+            "optimal_readable": _days_to_readable(optimal_days),
+            "maximum_readable": _days_to_readable(max_days)
         },
         "best_start_months": start_recommendation,
         "budget_note": budget_note,
         "goal_description": durations["description"],
-        "insight": f"Для цели '{goal}' оптимальная длительность: {days_to_readable(optimal_days)}. {durations['description']}"
+        "insight": f"Для цели '{goal}' оптимальная длительность: {_days_to_readable(optimal_days)}. {durations['description']}"
     }
 
 
@@ -1017,18 +1073,91 @@ TOOL_FUNCTIONS: Dict[str, Callable] = {
 
 # ==================== АГЕНТ ====================
 
+# Размер пула соединений к LLM API — не меньше числа параллельных запусков агента в UI
+LLM_POOL_SIZE = 8
+
+# Потоки для параллельного выполнения нескольких tool_call из одного ответа LLM
+TOOL_WORKERS = 8
+
+# Окно контекста: начиная с итерации CONTEXT_SUMMARY_AFTER + 1 в истории дословно остаются
+# только последние CONTEXT_KEEP_STEPS шагов, у более ранних остаются лишь вызовы и их результаты
+CONTEXT_SUMMARY_AFTER = 3
+CONTEXT_KEEP_STEPS = 2
+CONTEXT_SUMMARY_HEADER = "\n\n[Предыдущие шаги — использованные инструменты и их результаты:]\n"
+
+# Вызовы инструментов в ответе LLM: закрытые теги и незакрытый хвост (обрезан stop sequence).
+# Группа захватывает только JSON-объект без окружающих пробелов — strip() не нужен.
+# Тело не может пересечь </tool_call>: битый вызов не «съедает» следующий за ним
+_TOOL_CALL_RE = re.compile(r'<tool_call>\s*(\{(?:(?!</tool_call>).)*\})\s*</tool_call>', re.DOTALL)
+_TOOL_CALL_OPEN_RE = re.compile(r'<tool_call>\s*(\{.*?\})\s*$', re.DOTALL)
+
+_TOOL_CALL_OPEN_TAG = "<tool_call>"
+_TOOL_CALL_CLOSE_TAG = "</tool_call>"
+# После начала финального ответа тег в тексте — просто упоминание, поток дочитываем до конца
+_FINAL_ANSWER_MARKER = "ФИНАЛЬНЫЙ ОТВЕТ:"
+
+
+def _tool_calls_end(buf: str) -> int:
+    """
+    Позиция конца последнего закрытого <tool_call>, после которого модель
+    явно не начинает новый вызов; -1, если дочитывать поток ещё нужно.
+    """
+    end = buf.rfind(_TOOL_CALL_CLOSE_TAG)
+    if end == -1:
+        return -1
+    end += len(_TOOL_CALL_CLOSE_TAG)
+    tail = buf[end:].lstrip()
+    # Пустой хвост или начало следующего <tool_call> — ждём следующих токенов
+    if not tail or _TOOL_CALL_OPEN_TAG.startswith(tail[:len(_TOOL_CALL_OPEN_TAG)]):
+        return -1
+    return end
+
+
+def _summarize_tool_call(tool_name: str, arguments: Dict[str, Any], result: str) -> str:
+    """
+    Строка сводки для вызова, вытесненного из окна контекста.
+    Выбрасываются рассуждения модели и служебный текст шага, а компактный JSON результата
+    остаётся целиком: к финальному ответу все цифры ранних шагов должны быть под рукой.
+    """
+    return f"- {tool_name}({_dump_json(arguments)}): {result}"
+
+
 class MarketingAgent:
     """
     Агент для планирования маркетинговых мероприятий.
     Использует ReAct паттерн: Reasoning -> Action -> Observation -> Repeat
     """
     
-    def __init__(self, max_iterations: int = 8):
+    def __init__(self, max_iterations: int = 8, stream: bool = True, verbose: bool = False):
         self.max_iterations = max_iterations
+        # Потоковый ответ LLM: разбор идёт по мере прихода токенов, после tool_call соединение закрывается
+        self.stream = stream
+        # Подробный вывод в консоль (для отладки): промпт, ответы LLM, результаты инструментов
+        self.verbose = verbose
         self.api_url = "https://api.eliza.yandex.net/internal/deepseek-v3-1-terminus/v1/chat/completions"
         self.conversation_history: List[Dict[str, str]] = []
         
+        # Одна сессия на агента: keep-alive избавляет от TCP+TLS рукопожатия на каждой итерации
+        self._session = requests.Session()
+        self._session.verify = False
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=LLM_POOL_SIZE, max_retries=0)
+        self._session.mount("https://", adapter)
+        # Токен читается из окружения один раз (.env подгружается при импорте модуля)
+        self._auth_header = f"Bearer {os.environ.get('SOY_TOKEN')}"
+        self._static_headers = {
+            "Authorization": self._auth_header,
+            "Content-Type": "application/json"
+        }
+        # Пул потоков общий для всех запусков агента — не создаём его на каждой итерации
+        self._tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+        # TOOLS_SCHEMA статична — промпт собираем один раз, а не на каждый запрос
+        self._system_prompt = self._build_system_prompt()
+    
     def _get_system_prompt(self) -> str:
+        """Возвращает системный промпт, собранный при создании агента"""
+        return self._system_prompt
+        
+    def _build_system_prompt(self) -> str:
         # Формируем детальное описание инструментов с параметрами
         tools_lines = []
         for tool in TOOLS_SCHEMA:
@@ -1086,25 +1215,24 @@ class MarketingAgent:
             "messages": messages,
             "max_tokens": 4096,
             "temperature": 0.3,
-            "stop": ["</tool_call>\n\n", "<tool_result>"]
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {os.environ.get('SOY_TOKEN')}",
-            "Content-Type": "application/json"
+            "stop": ["</tool_call>\n\n", "<tool_result>"],
+            "stream": self.stream
         }
         
         for attempt in range(max_retries):
             try:
-                response = requests.post(
+                response = self._session.post(
                     self.api_url, 
                     json=payload, 
-                    headers=headers, 
-                    verify=False, 
-                    timeout=120
+                    headers=self._static_headers, 
+                    timeout=120,
+                    stream=self.stream
                 )
-                response.raise_for_status()
-                return response.json()['response']['choices'][0]['message']['content']
+                with response:
+                    response.raise_for_status()
+                    if response.headers.get("Content-Type", "").startswith("text/event-stream"):
+                        return self._read_stream(response)
+                    return response.json()['response']['choices'][0]['message']['content']
             
             except requests.exceptions.HTTPError as e:
                 if response.status_code == 429:
@@ -1117,9 +1245,12 @@ class MarketingAgent:
                     print(f"LLM HTTP Error: {e}")
                     return None
             
-            except requests.exceptions.Timeout:
+            # При stream=True зависание чтения в iter_lines() приходит как ConnectionError,
+            # а обрыв потока — как ChunkedEncodingError; повторяем их так же, как таймаут
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError) as e:
                 wait_time = 5
-                print(f"⏳ Timeout. Жду {wait_time} сек... (попытка {attempt + 1}/{max_retries})")
+                print(f"⏳ {type(e).__name__}. Жду {wait_time} сек... (попытка {attempt + 1}/{max_retries})")
                 time.sleep(wait_time)
                 continue
                 
@@ -1130,39 +1261,104 @@ class MarketingAgent:
         print(f"❌ Превышено количество попыток ({max_retries})")
         return None
 
+    def _read_stream(self, response: requests.Response) -> str:
+        """
+        Собирает ответ из SSE-потока (data: {...} ... data: [DONE]).
+        Как только в тексте есть законченные вызовы инструментов, дальнейшую генерацию не ждём
+        (если только модель уже не начала финальный ответ).
+        """
+        buf = ""
+        close_seen = False
+        final_seen = False
+        
+        # Строки читаем байтами: у SSE часто нет charset, а orjson/json разбирают UTF-8 сами
+        for line in response.iter_lines():
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                break
+            
+            chunk = _load_json(data)
+            chunk = chunk.get("response", chunk)
+            choices = chunk.get("choices")
+            if not choices:
+                continue
+            delta = (choices[0].get("delta") or {}).get("content")
+            if not delta:
+                continue
+            
+            prev_len = len(buf)
+            buf += delta
+            
+            # Теги ищем только в новом хвосте (с запасом на тег, разрезанный между чанками)
+            if not final_seen:
+                final_seen = _FINAL_ANSWER_MARKER in buf[max(0, prev_len - len(_FINAL_ANSWER_MARKER) + 1):]
+            if not close_seen:
+                close_seen = _TOOL_CALL_CLOSE_TAG in buf[max(0, prev_len - len(_TOOL_CALL_CLOSE_TAG) + 1):]
+            if close_seen and not final_seen:
+                end = _tool_calls_end(buf)
+                if end != -1:
+                    return buf[:end]
+        
+        return buf
+
     def _parse_tool_calls(self, response: str) -> List[Dict[str, Any]]:
         """Извлекает вызовы инструментов из ответа LLM"""
         tool_calls = []
         
         # Пробуем найти завершённые теги
-        pattern = r'<tool_call>\s*(.*?)\s*</tool_call>'
-        matches = re.findall(pattern, response, re.DOTALL)
+        matches = _TOOL_CALL_RE.findall(response)
         
         # Если не нашли закрытые теги, ищем незакрытые (из-за stop sequence)
         if not matches:
-            pattern_open = r'<tool_call>\s*(\{.*?\})\s*$'
-            matches = re.findall(pattern_open, response, re.DOTALL)
+            matches = _TOOL_CALL_OPEN_RE.findall(response)
         
         for match in matches:
             try:
-                tool_call = json.loads(match.strip())
-                if "name" in tool_call and "arguments" in tool_call:
+                tool_call = _load_json(match)
+                # Ответ LLM может быть любой формы: run_stream ждёт строковое имя и dict аргументов
+                if isinstance(tool_call.get("name"), str) and isinstance(tool_call.get("arguments"), dict):
                     tool_calls.append(tool_call)
             except json.JSONDecodeError:
                 continue
                 
         return tool_calls
 
-    def _execute_tool(self, tool_name: str, arguments: Dict[str, Any]) -> str:
-        """Выполняет инструмент и возвращает результат"""
-        if tool_name not in TOOL_FUNCTIONS:
-            return json.dumps({"error": f"Инструмент '{tool_name}' не найден"}, ensure_ascii=False)
+    def _execute_tool(self, tool_name: str, arguments: Dict[str, Any], cache: Optional[Dict[tuple, str]] = None) -> str:
+        """
+        Выполняет инструмент и возвращает результат.
+        
+        cache — словарь одного запуска агента: повторный идентичный tool_call
+        возвращает уже готовую JSON-строку без вызова и сериализации.
+        """
+        if cache is not None:
+            key = (tool_name, json.dumps(arguments, sort_keys=True, ensure_ascii=False))
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
         
-        try:
-            result = TOOL_FUNCTIONS[tool_name](**arguments)
-            return json.dumps(result, ensure_ascii=False, indent=2)
-        except Exception as e:
-            return json.dumps({"error": str(e)}, ensure_ascii=False)
+        # Один поиск в TOOL_FUNCTIONS вместо проверки "in" и повторного обращения по ключу
+        if (tool := TOOL_FUNCTIONS.get(tool_name)) is None:
+            result = _dump_json({"error": f"Инструмент '{tool_name}' не найден"})
+        else:
+            try:
+                try:
+                    value = tool(**arguments)
+                except TypeError:
+                    # LLM может передать список или словарь: lru_cache такие аргументы не хэширует,
+                    # тогда вызываем функцию в обход кэша (ошибки самой функции всплывут снова)
+                    if (uncached := getattr(tool, "__wrapped__", None)) is None:
+                        raise
+                    value = uncached(**arguments)
+                # Компактный JSON: модели меньше токенов, по сети меньше байт
+                result = _dump_json(value)
+            except Exception as e:
+                result = _dump_json({"error": str(e)})
+        
+        if cache is not None:
+            cache[key] = result
+        return result
 
     def run_stream(self, user_query: str):
         """
@@ -1191,16 +1387,39 @@ class MarketingAgent:
         print("-"*60)
         
         messages = [
-            {"role": "system", "content": self._get_system_prompt()},
+            {"role": "system", "content": self._system_prompt},
             {"role": "user", "content": sanitized_query}
         ]
         
+        if self.verbose:
+            print("SYSTEM PROMPT (первые 500 символов):")
+            print(self._system_prompt[:500] + "...")
+            print("-"*60)
+        
         progress_log = []
+        # Результаты инструментов в пределах этого запуска (агент общий для всех сессий UI)
+        tool_cache: Dict[tuple, str] = {}
+        # Вызовы инструментов по шагам (пара assistant/user в messages) — для сводки старых шагов.
+        # Локально, а не в self: один агент обслуживает параллельные сессии
+        tool_log: List[List[tuple]] = []
+        summary_lines: List[str] = []
         iteration = 0
         
         while iteration < self.max_iterations:
             iteration += 1
             
+            # История не растёт бесконечно: старые шаги сворачиваются в сводку к исходному запросу
+            if iteration > CONTEXT_SUMMARY_AFTER and len(tool_log) > CONTEXT_KEEP_STEPS:
+                dropped = len(tool_log) - CONTEXT_KEEP_STEPS
+                for calls in tool_log[:dropped]:
+                    summary_lines.extend(_summarize_tool_call(*call) for call in calls)
+                del tool_log[:dropped]
+                del messages[2:2 + 2 * dropped]
+                messages[1] = {
+                    "role": "user",
+                    "content": sanitized_query + CONTEXT_SUMMARY_HEADER + "\n".join(summary_lines)
+                }
+            
             print(f"\n📍 Итерация {iteration}/{self.max_iterations}")
             progress_log.append(f"🔄 Итерация {iteration}: Думаю над задачей...")
             yield "\n".join(progress_log), ""
@@ -1224,6 +1443,12 @@ class MarketingAgent:
                 return
             
             print(f"   ← Получен ответ ({len(response)} символов)")
+            if self.verbose:
+                print("-"*40)
+                print(response[:1500])
+                if len(response) > 1500:
+                    print(f"... (ещё {len(response) - 1500} символов)")
+                print("-"*40)
             
             # Проверяем, есть ли финальный ответ
             if "ФИНАЛЬНЫЙ ОТВЕТ:" in response:
@@ -1249,10 +1474,10 @@ class MarketingAgent:
                     "role": "user", 
                     "content": "Пожалуйста, используй доступные инструменты для анализа или дай ФИНАЛЬНЫЙ ОТВЕТ: с ранжированным списком мероприятий."
                 })
+                tool_log.append([])
                 continue
             
-            # Выполняем инструменты
-            tool_results = []
+            # Выполняем инструменты: сначала показываем все вызовы, затем считаем их параллельно
             for tool_call in tool_calls:
                 tool_name = tool_call["name"]
                 arguments = tool_call["arguments"]
@@ -1263,21 +1488,33 @@ class MarketingAgent:
                     print(f"   │  {k}: {v}")
                 
                 progress_log.append(f"🔧 Вызываю: {tool_name}")
-                yield "\n".join(progress_log), ""
-                
-                result = self._execute_tool(tool_name, arguments)
-                result_dict = json.loads(result)
-                
-                print(f"   └─ Result:")
-                for k, v in result_dict.items():
-                    if isinstance(v, dict):
-                        print(f"      {k}:")
-                        for k2, v2 in v.items():
-                            print(f"         {k2}: {v2}")
-                    elif isinstance(v, list):
-                        print(f"      {k}: {v}")
-                    else:
-                        print(f"      {k}: {v}")
+            yield "\n".join(progress_log), ""
+            
+            if len(tool_calls) == 1:
+                results = [self._execute_tool(tool_calls[0]["name"], tool_calls[0]["arguments"], tool_cache)]
+            else:
+                futures = [
+                    self._tool_executor.submit(self._execute_tool, tool_call["name"], tool_call["arguments"], tool_cache)
+                    for tool_call in tool_calls
+                ]
+                # Порядок результатов совпадает с порядком вызовов в ответе LLM
+                results = [future.result() for future in futures]
+            
+            tool_results = []
+            for tool_call, result in zip(tool_calls, results):
+                if self.verbose:
+                    result_dict = _load_json(result)
+                    
+                    print(f"\n   └─ Result ({tool_call['name']}):")
+                    for k, v in result_dict.items():
+                        if isinstance(v, dict):
+                            print(f"      {k}:")
+                            for k2, v2 in v.items():
+                                print(f"         {k2}: {v2}")
+                        elif isinstance(v, list):
+                            print(f"      {k}: {v}")
+                        else:
+                            print(f"      {k}: {v}")
                 
                 tool_results.append(f"<tool_result>\n{result}\n</tool_result>")
             
@@ -1293,6 +1530,13 @@ class MarketingAgent:
                 "role": "user", 
                 "content": "Результаты инструментов:\n" + "\n".join(tool_results) + reminder
             })
+            tool_log.append([
+                (tool_call["name"], tool_call["arguments"], result)
+                for tool_call, result in zip(tool_calls, results)
+            ])
+            
+            if self.verbose:
+                print(f"\n   📝 Всего сообщений в истории: {len(messages)}")
         
         print("\n❌ Достигнут лимит итераций")
         progress_log.append("❌ Достигнут лимит итераций")